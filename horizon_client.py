@@ -1,26 +1,615 @@
 #!/usr/bin/env python3
 
+import atexit
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared session so repeated queries reuse pooled keep-alive connections
+# instead of paying a fresh TCP+TLS handshake per request. Each subsite's
+# pool keeps up to _POOL_SIZE connections, matching the default concurrency
+# of horizon_fetcher.aget_product_ids.
+_POOL_SIZE = 64
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=_POOL_SIZE, max_retries=Retry(total=3, backoff_factor=0.2))
+_session.mount('https://', _adapter)
+_session.mount('http://', _adapter)
+atexit.register(_session.close)
+
+# Optional HTTP/2 transport for Horizon requests: with HORIZON_HTTP2=1 and
+# httpx[http2] installed, concurrent queries to a subsite are multiplexed
+# over one connection instead of one socket each. httpx is only imported
+# when enabled, since loading it noticeably slows down CLI start-up.
+_http2_client = None
+# httpx only negotiates HTTP/2 when h2 is installed too.
+if os.environ.get('HORIZON_HTTP2') == '1' and importlib.util.find_spec('h2') is not None:
+    try:
+        import httpx
+    except ImportError:
+        pass
+    else:
+        _http2_client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            timeout=30.0,
+        )
+        atexit.register(_http2_client.close)
+
+# Subsites that answered a persisted query with PERSISTED_QUERY_NOT_SUPPORTED,
+# or rejected the hash alone while accepting the full text; they get the full
+# query text from then on. The result is also stored in the cache backend
+# (see _mark_apq_unsupported), so a new process does not pay an extra
+# round-trip to find it out again; _apq_checked holds the subsites whose
+# stored result has been looked up.
+_apq_unsupported = set()
+_apq_checked = set()
+
+# Identical queries currently being fetched, keyed by cache key, so that
+# concurrent callers share one HTTP request.
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# Successful Horizon responses are cached for an hour so reruns skip the
+# network: on disk by default, or in Redis when HORIZON_REDIS_URL is set and
+# the redis package is installed. Set HORIZON_NO_CACHE=1 to bypass the cache.
+_CACHE_DIR = Path(os.environ.get('HORIZON_CACHE_DIR', '~/.cache/horizon')).expanduser()
+_CACHE_TTL = 3600
+# Entries larger than this are stored gzip-compressed
+_CACHE_GZIP_MIN = 4096
+# Set once this process has swept expired entries out of the disk cache
+_cache_swept = False
+# How long a subsite is remembered as not supporting persisted queries
+_APQ_MARKER_TTL = 86400
+
+_redis = None
+if os.environ.get('HORIZON_REDIS_URL'):
+    try:
+        import redis
+        # Short timeouts so an unreachable server costs a cache miss, not a stalled query
+        _redis = redis.Redis.from_url(os.environ['HORIZON_REDIS_URL'], socket_connect_timeout=0.5, socket_timeout=0.5)
+    except (ImportError, ValueError):
+        # redis not installed, or a malformed URL (e.g. missing the redis:// scheme)
+        _redis = None
+
+
+class HorizonRateLimiter:
+    """
+    Per-subsite request rate limiter with exponential backoff.
+
+    Each subsite gets a token bucket refilled at default_rps requests per
+    second. Rate limit headers on responses (Retry-After,
+    X-RateLimit-Remaining) tighten the bucket, and 429/5xx responses are
+    retried after an exponentially growing, jittered delay.
+
+    Pass one instance as rate_limiter= to the query functions (or the
+    horizon_fetcher helpers) and share it between concurrent callers.
+    """
+
+    def __init__(self, default_rps: float = 10, max_retries: int = 5, backoff_base: float = 0.5, backoff_cap: float = 30.0):
+        if default_rps <= 0:
+            raise ValueError("default_rps must be positive")
+        self.default_rps = default_rps
+        # Room for at least one token, so rates below 1 rps still let requests through
+        self._capacity = max(1.0, default_rps)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._tokens = {}
+        self._updated = {}
+        self._blocked_until = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, subsite: str):
+        """Block until a request to subsite is allowed, then take a token."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens = self._tokens.get(subsite, self._capacity)
+                elapsed = now - self._updated.get(subsite, now)
+                tokens = min(self._capacity, tokens + elapsed * self.default_rps)
+                self._updated[subsite] = now
+
+                wait = self._blocked_until.get(subsite, 0) - now
+                if wait <= 0 and tokens >= 1:
+                    self._tokens[subsite] = tokens - 1
+                    return
+                self._tokens[subsite] = tokens
+                wait = max(wait, (1 - tokens) / self.default_rps)
+            time.sleep(wait)
+
+    def update(self, subsite: str, response, attempt: int = 0):
+        """
+        Record a response's rate limit headers.
+
+        Returns:
+            True if the request should be retried (429 or 5xx and retries remain)
+        """
+        headers = response.headers
+        retry = (response.status_code == 429 or response.status_code >= 500) and attempt < self.max_retries
+
+        delay = 0
+        retry_after = headers.get('Retry-After')
+        if retry_after is not None and retry_after.isdigit() and int(retry_after) > 0:
+            delay = int(retry_after)
+        elif retry:
+            delay = min(self.backoff_cap, self.backoff_base * 2 ** attempt) + random.uniform(0, self.backoff_base)
+
+        with self._lock:
+            now = time.monotonic()
+            if headers.get('X-RateLimit-Remaining') == '0':
+                # Empty the bucket as of now, so the time spent on this
+                # request's round-trip is not refilled on the next acquire
+                self._tokens[subsite] = 0
+                self._updated[subsite] = now
+            if delay:
+                self._blocked_until[subsite] = max(self._blocked_until.get(subsite, 0), now + delay)
+        return retry
 
 
 def get_rocinante_subsites():
     """Fetch subsite data from Rocinante API."""
     rocinante_url = 'http://rocinante.io.thehut.local/api/v1/subsites'
-    response = requests.get(rocinante_url)
+    response = _session.get(rocinante_url)
     return response.json()
 
 
-def query_horizon(query: str, subsite: str = 'www.myprotein.com'):
+def query_horizon(query: str, subsite: str = 'www.myprotein.com', variables: dict = None, rate_limiter: HorizonRateLimiter = None):
     """
     Execute a GraphQL query against the Horizon API.
 
     Args:
         query: GraphQL query string
         subsite: The subsite domain (e.g., 'www.myprotein.com')
+        variables: Optional values for the query's $variables
+        rate_limiter: Optional HorizonRateLimiter to pace and retry the request
 
     Returns:
         Response content from the Horizon API
     """
-    horizon_url = f'https://horizon-api.{subsite}/graphql'
-    response = requests.post(url=horizon_url, json={"query": query})
-    return response.content.decode(encoding='utf-8')
+    return _query(query, subsite, variables, persisted=False, rate_limiter=rate_limiter).decode(encoding='utf-8')
+
+
+def query_horizon_raw(query: str, subsite: str = 'www.myprotein.com', variables: dict = None, rate_limiter: HorizonRateLimiter = None, persisted: bool = False):
+    """
+    Execute a GraphQL query against the Horizon API, returning raw bytes.
+
+    Same as query_horizon but skips decoding the response, which saves a
+    full copy of large payloads that are passed straight to a JSON parser
+    (json.loads and orjson.loads both accept bytes).
+
+    Args:
+        query: GraphQL query string
+        subsite: The subsite domain (e.g., 'www.myprotein.com')
+        variables: Optional values for the query's $variables
+        rate_limiter: Optional HorizonRateLimiter to pace and retry the request
+        persisted: Send the query as an Automatic Persisted Query, as
+            query_horizon_persisted does
+
+    Returns:
+        Response content from the Horizon API as bytes
+    """
+    return _query(query, subsite, variables, persisted=persisted, rate_limiter=rate_limiter)
+
+
+@contextmanager
+def query_horizon_stream(query: str, subsite: str = 'www.myprotein.com', variables: dict = None):
+    """
+    Execute a GraphQL query and expose the response body as a stream.
+
+    For use as a context manager; the yielded object is a binary file-like
+    body that can be parsed incrementally (e.g. with ijson) while it is still
+    downloading. A fresh entry in the disk cache is served from memory (except
+    for mutations), but streamed responses are not written to the cache and
+    are not coalesced with concurrent identical queries.
+
+    Args:
+        query: GraphQL query string
+        subsite: The subsite domain (e.g., 'www.myprotein.com')
+        variables: Optional values for the query's $variables
+
+    Yields:
+        Binary file-like object with the response content
+    """
+    content = None if _is_mutation(query) else _cache_get(_cache_key(query, subsite, variables))
+    if content is not None:
+        yield io.BytesIO(content)
+        return
+
+    body = {"query": query}
+    if variables is not None:
+        body["variables"] = variables
+
+    if _http2_client is not None:
+        # httpx exposes no file-like body, so read it in full
+        yield io.BytesIO(_http2_client.post(url=_horizon_url(subsite), json=body).content)
+        return
+
+    response = _session.post(url=_horizon_url(subsite), json=body, stream=True)
+    try:
+        # Let urllib3 undo any gzip Content-Encoding as the body is read
+        response.raw.decode_content = True
+        yield response.raw
+    finally:
+        response.close()
+
+
+def query_horizon_persisted(query: str, subsite: str = 'www.myprotein.com', variables: dict = None, rate_limiter: HorizonRateLimiter = None):
+    """
+    Execute a GraphQL query using Automatic Persisted Queries (APQ).
+
+    Only the SHA-256 hash of the query is sent. If the server has not seen the
+    query yet it answers PERSISTED_QUERY_NOT_FOUND and the request is repeated
+    with the full query text, which registers it for later calls. Subsites
+    that do not support APQ fall back to sending the full query.
+
+    The query text should take its inputs as $variables so that it, and its
+    hash, are the same for every call.
+
+    Args:
+        query: GraphQL query string
+        subsite: The subsite domain (e.g., 'www.myprotein.com')
+        variables: Optional values for the query's $variables
+        rate_limiter: Optional HorizonRateLimiter to pace and retry the request
+
+    Returns:
+        Response content from the Horizon API
+    """
+    return _query(query, subsite, variables, persisted=True, rate_limiter=rate_limiter).decode(encoding='utf-8')
+
+
+def _query(query: str, subsite: str, variables, persisted: bool, rate_limiter=None):
+    if _is_mutation(query):
+        # Mutations have side effects: send every one, and never replay a cached result
+        return _fetch(query, subsite, variables, persisted, rate_limiter).content
+    cache_key = _cache_key(query, subsite, variables)
+    content = _cache_get(cache_key)
+    if content is None:
+        content = _coalesce(cache_key, lambda: _cache_put(cache_key, _fetch(query, subsite, variables, persisted, rate_limiter)))
+    return content
+
+
+def _coalesce(key: str, fetch):
+    """
+    Run fetch() once for all concurrent callers that share the same key.
+
+    The first caller performs the request; callers arriving while it is in
+    flight wait for and share its result (or exception).
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = _inflight[key] = Future()
+
+    if not is_leader:
+        return future.result()
+
+    try:
+        result = fetch()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+
+def _fetch(query: str, subsite: str, variables, persisted: bool, rate_limiter=None):
+    body = {}
+    if variables is not None:
+        body["variables"] = variables
+
+    if persisted and not _apq_disabled(subsite):
+        body["extensions"] = {"persistedQuery": {"version": 1, "sha256Hash": _query_hash(query)}}
+        response = _post_horizon(body, subsite, rate_limiter)
+        if response.status_code == 429 or response.status_code >= 500:
+            # A transient failure says nothing about APQ support
+            return response
+        if not _is_failed_response(response):
+            return response
+
+        content = response.content
+        if b'PERSISTED_QUERY_NOT_SUPPORTED' in content or b'PersistedQueryNotSupported' in content:
+            _mark_apq_unsupported(subsite)
+            del body["extensions"]
+        else:
+            # Either the hash is not registered yet, or the server ignored it
+            # and wants the query text: resend with both, which registers it
+            body["query"] = query
+            full_response = _post_horizon(body, subsite, rate_limiter)
+            not_found = b'PERSISTED_QUERY_NOT_FOUND' in content or b'PersistedQueryNotFound' in content
+            if not not_found and not _is_failed_response(full_response):
+                # The full text works where the hash alone failed without a
+                # NOT_FOUND, so this subsite does not do APQ
+                _mark_apq_unsupported(subsite)
+            return full_response
+
+    body["query"] = query
+    return _post_horizon(body, subsite, rate_limiter)
+
+
+def _apq_disabled(subsite: str):
+    """Whether persisted queries are known not to work on subsite."""
+    if subsite in _apq_unsupported:
+        return True
+    if subsite not in _apq_checked:
+        _apq_checked.add(subsite)
+        if _apq_marker_exists(subsite):
+            _apq_unsupported.add(subsite)
+            return True
+    return False
+
+
+def _mark_apq_unsupported(subsite: str):
+    _apq_unsupported.add(subsite)
+    if _redis is not None:
+        try:
+            _redis.setex('horizon:apq-unsupported:' + subsite, _APQ_MARKER_TTL, b'1')
+        except redis.RedisError:
+            pass
+        return
+
+    try:
+        marker = _CACHE_DIR / 'apq-unsupported' / subsite
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+    except OSError:
+        pass
+
+
+def _apq_marker_exists(subsite: str):
+    if _redis is not None:
+        try:
+            return bool(_redis.exists('horizon:apq-unsupported:' + subsite))
+        except redis.RedisError:
+            return False
+
+    try:
+        return time.time() - (_CACHE_DIR / 'apq-unsupported' / subsite).stat().st_mtime < _APQ_MARKER_TTL
+    except OSError:
+        return False
+
+
+def _is_failed_response(response):
+    """Whether a GraphQL response is an error rather than a (possibly partial) result."""
+    if response.status_code != 200:
+        return True
+    if b'"errors"' not in response.content:
+        return False
+    try:
+        payload = json.loads(response.content)
+    except ValueError:
+        return True
+    return not isinstance(payload, dict) or payload.get('data') is None
+
+
+@lru_cache(maxsize=256)
+def _query_hash(query: str):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+# A mutation operation at the start of the document or after another
+# operation's closing brace; comments are stripped first
+_MUTATION_RE = re.compile(r'(?:^|\})\s*mutation\b')
+_COMMENT_RE = re.compile(r'#[^\n]*')
+
+
+@lru_cache(maxsize=256)
+def _is_mutation(query: str):
+    return _MUTATION_RE.search(_COMMENT_RE.sub('', query)) is not None
+
+
+def _cache_key(query: str, subsite: str, variables):
+    key = json.dumps([subsite, query, variables], sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _cache_get(cache_key: str):
+    """Return cached response content, or None on a miss or expired entry."""
+    if os.environ.get('HORIZON_NO_CACHE') == '1':
+        return None
+    data = _cache_read(cache_key)
+    if data is not None and data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    return data
+
+
+def _cache_put(cache_key: str, response):
+    """Cache a successful response and return its content."""
+    content = response.content
+    if os.environ.get('HORIZON_NO_CACHE') == '1' or response.status_code != 200 or b'"errors"' in content:
+        return content
+    # JSON never starts with the gzip magic bytes, so entries need no other marker
+    _cache_write(cache_key, gzip.compress(content, compresslevel=1) if len(content) > _CACHE_GZIP_MIN else content)
+    return content
+
+
+def _cache_read(cache_key: str):
+    if _redis is not None:
+        try:
+            return _redis.get('horizon:' + cache_key)
+        except redis.RedisError:
+            return None
+
+    path = _CACHE_DIR / cache_key
+    try:
+        if time.time() - path.stat().st_mtime > _CACHE_TTL:
+            path.unlink()
+            return None
+        return path.read_bytes()
+    except OSError:
+        return None
+
+
+def _cache_write(cache_key: str, data: bytes):
+    if _redis is not None:
+        try:
+            _redis.setex('horizon:' + cache_key, _CACHE_TTL, data)
+        except redis.RedisError:
+            pass
+        return
+
+    try:
+        _CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=_CACHE_DIR)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, _CACHE_DIR / cache_key)
+    except OSError:
+        pass
+    _cache_sweep()
+
+
+def _cache_sweep():
+    """
+    Delete expired disk cache entries.
+
+    Entries that are never read again would otherwise pile up forever, so
+    the first write in a process sweeps the cache directory, unless another
+    process already did within the last _CACHE_TTL.
+    """
+    global _cache_swept
+    if _cache_swept:
+        return
+    _cache_swept = True
+
+    marker = _CACHE_DIR / '.swept'
+    now = time.time()
+    try:
+        if now - marker.stat().st_mtime < _CACHE_TTL:
+            return
+    except OSError:
+        pass
+
+    try:
+        marker.touch()
+        with os.scandir(_CACHE_DIR) as entries:
+            for entry in entries:
+                # Only entries (and leftover temporary files) are plain files
+                # at the top level; subdirectories hold other state
+                if entry.is_file(follow_symlinks=False) and entry.name != '.swept':
+                    try:
+                        if now - entry.stat().st_mtime > _CACHE_TTL:
+                            os.unlink(entry.path)
+                    except OSError:
+                        pass
+    except OSError:
+        pass
+
+
+@lru_cache(maxsize=None)
+def _horizon_url(subsite: str):
+    return f'https://horizon-api.{subsite}/graphql'
+
+
+def _post_horizon(body, subsite: str, rate_limiter: HorizonRateLimiter = None):
+    client = _http2_client if _http2_client is not None else _session
+    if rate_limiter is None:
+        return client.post(url=_horizon_url(subsite), json=body)
+
+    attempt = 0
+    while True:
+        rate_limiter.acquire(subsite)
+        response = client.post(url=_horizon_url(subsite), json=body)
+        if not rate_limiter.update(subsite, response, attempt):
+            return response
+        attempt += 1
+
+
+def query_horizon_batch(queries, subsite: str = 'www.myprotein.com'):
+    """
+    Execute several GraphQL queries against the Horizon API in a single POST.
+
+    The queries are sent as a JSON array of operations, which the server
+    answers with an array of results.
+
+    Args:
+        queries: Iterable of GraphQL query strings or (query, variables) pairs
+        subsite: The subsite domain (e.g., 'www.myprotein.com')
+
+    Returns:
+        List of response contents, in the same order as queries
+
+    Raises:
+        ValueError: If the server does not answer with one result per query
+            (e.g. because it does not support batched operations)
+    """
+    operations = [_as_operation(query) for query in queries]
+    response = _post_horizon(operations, subsite)
+    results = response.json()
+    if not isinstance(results, list) or len(results) != len(operations):
+        raise ValueError("Horizon API did not return a batched response")
+    return [json.dumps(result) for result in results]
+
+
+async def aquery_horizon(query: str, subsite: str = 'www.myprotein.com', variables: dict = None, rate_limiter: HorizonRateLimiter = None, executor=None):
+    """
+    Async variant of query_horizon.
+
+    The blocking request runs in a worker thread, so several queries awaited
+    together overlap their network round-trips. The event loop's default
+    thread pool only has min(32, CPUs + 4) threads; pass a larger executor
+    to run more queries at once.
+
+    Args:
+        query: GraphQL query string
+        subsite: The subsite domain (e.g., 'www.myprotein.com')
+        variables: Optional values for the query's $variables
+        rate_limiter: Optional HorizonRateLimiter to pace and retry the request
+        executor: Optional concurrent.futures executor to run the request on
+            (default: the event loop's default thread pool)
+
+    Returns:
+        Response content from the Horizon API
+    """
+    import asyncio
+    return await asyncio.get_running_loop().run_in_executor(executor, query_horizon, query, subsite, variables, rate_limiter)
+
+
+async def query_horizon_many(queries, subsite: str = 'www.myprotein.com', max_workers: int = 32):
+    """
+    Execute several GraphQL queries against the Horizon API concurrently.
+
+    Args:
+        queries: Iterable of GraphQL query strings or (query, variables) pairs
+        subsite: The subsite domain (e.g., 'www.myprotein.com')
+        max_workers: Maximum number of requests in flight at once
+
+    Returns:
+        List of response contents, in the same order as queries
+    """
+    import asyncio
+    operations = [_as_operation(query) for query in queries]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return await asyncio.gather(*[
+            aquery_horizon(operation["query"], subsite, operation.get("variables"), executor=executor)
+            for operation in operations
+        ])
+
+
+def _as_operation(query):
+    """Turn a query string or (query, variables) pair into a GraphQL request body."""
+    if isinstance(query, str):
+        return {"query": query}
+    query, variables = query
+    return {"query": query, "variables": variables}
@@ -1,16 +1,135 @@
+import io
 import json
+import os
 import re
 import sys
-import argparse
-from urllib.parse import urlparse
-from horizon_client import query_horizon
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from types import SimpleNamespace
+from horizon_client import query_horizon_batch, query_horizon_many, query_horizon_raw, query_horizon_stream
+
+# orjson is optional: it parses large responses several times faster, but
+# Writer agents only ship the standard json module.
+try:
+    import orjson
+    _loads = orjson.loads
+
+    def _dumps_pretty(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    orjson = None
+    _loads = json.loads
+
+    def _dumps_pretty(obj):
+        return json.dumps(obj, indent=2).encode('utf-8')
+
+
+@lru_cache(maxsize=None)
+def _load_ijson():
+    """Import ijson on first use, or return None if it is not installed."""
+    try:
+        import ijson
+    except ImportError:
+        return None
+    return ijson
+
+
+# ijson is optional too: with it, get_product_ids_stream pulls product URLs
+# out of the response while it is still downloading.
+#
+# The list and search queries only select url, so on an already downloaded
+# response a full parse builds little more than the URLs themselves, and
+# orjson does it faster than any ijson backend. The buffered extractors only
+# use ijson instead of json.loads when orjson is missing and ijson has its C
+# backend, so it is only imported here in that case; otherwise importing
+# this module leaves it to get_product_ids_stream.
+ijson = _load_ijson() if orjson is None else None
+_IJSON_EXTRACT = ijson is not None and ijson.backend == 'yajl2_c'
+
+# Product ID in a product URL: /p/category/product-name/12345678/ (ASCII digits only)
+_ID_RE = re.compile(r'/(\d+)/', re.ASCII)
+
+# Field sets for product queries
+PRODUCT_FULL_FIELDS = ('sku', 'title', 'content', 'variants')
+PRODUCT_SUMMARY_FIELDS = ('sku', 'title')
+
+
+def get_product_json(product_id: int, subsite: str = 'www.myprotein.com', fields=PRODUCT_FULL_FIELDS, rate_limiter=None, raw=False):
+    query, variables = get_product_query(product_id, fields)
+    return _query_persisted(query, subsite, variables, rate_limiter, raw)
+
+
+def _query_persisted(query, subsite, variables, rate_limiter, raw):
+    """Send a persisted query, returning the response as bytes if raw, else as str."""
+    content = query_horizon_raw(query, subsite, variables, rate_limiter, persisted=True)
+    return content if raw else content.decode('utf-8')
+
+
+def get_product_jsons(product_ids, subsite: str = 'www.myprotein.com', max_workers: int = 32, fields=PRODUCT_FULL_FIELDS, rate_limiter=None):
+    """
+    Fetch product data for several product IDs using a thread pool.
+
+    Args:
+        product_ids: Iterable of product IDs (SKUs)
+        subsite: The subsite domain
+        max_workers: Maximum number of requests in flight at once
+        fields: Product fields to request (see get_product_query)
+        rate_limiter: Optional horizon_client.HorizonRateLimiter to pace and retry requests
+
+    Returns:
+        List of JSON responses from Horizon API, in the same order as product_ids
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda product_id: get_product_json(product_id, subsite, fields, rate_limiter), product_ids))
+
+
+def get_product_jsons_batched(product_ids, subsite: str = 'www.myprotein.com', batch_size: int = 25, fields=PRODUCT_FULL_FIELDS):
+    """
+    Fetch product data for several product IDs using batched GraphQL requests.
+
+    Product queries are sent batch_size at a time in a single POST each. If the
+    server rejects batched operations, the remaining products are fetched
+    concurrently with get_product_jsons instead.
+
+    Args:
+        product_ids: Iterable of product IDs (SKUs)
+        subsite: The subsite domain
+        batch_size: Maximum number of queries per POST
+        fields: Product fields to request (see get_product_query)
+
+    Returns:
+        List of JSON responses from Horizon API, in the same order as product_ids
+    """
+    product_ids = list(product_ids)
+    results = []
+    for start in range(0, len(product_ids), batch_size):
+        batch = product_ids[start:start + batch_size]
+        try:
+            results.extend(query_horizon_batch([get_product_query(product_id, fields) for product_id in batch], subsite))
+        except ValueError:
+            return results + get_product_jsons(product_ids[start:], subsite, fields=fields)
+    return results
+
+
+async def get_all_product_jsons(product_ids, subsite: str = 'www.myprotein.com', fields=PRODUCT_FULL_FIELDS, max_workers: int = 32):
+    """
+    Fetch product data for several product IDs concurrently.
 
-def get_product_json(product_id: int, subsite: str = 'www.myprotein.com'):
-    query = get_product_query(product_id)
-    return query_horizon(query, subsite)
+    Args:
+        product_ids: Iterable of product IDs (SKUs)
+        subsite: The subsite domain
+        fields: Product fields to request (see get_product_query)
+        max_workers: Maximum number of requests in flight at once
+
+    Returns:
+        List of JSON responses from Horizon API, in the same order as product_ids
+    """
+    queries = [get_product_query(product_id, fields) for product_id in product_ids]
+    return await query_horizon_many(queries, subsite, max_workers)
 
 
-def get_product_list(product_list_path: str, subsite: str = 'www.myprotein.com', limit: int = 100, offset: int = 0, currency: str = 'GBP', shippingDestination: str = 'GB', sort: str = 'RELEVANCE'):
+def get_product_list(product_list_path: str, subsite: str = 'www.myprotein.com', limit: int = 100, offset: int = 0, currency: str = 'GBP', shippingDestination: str = 'GB', sort: str = 'RELEVANCE', rate_limiter=None, raw=False):
     """
     Fetch product list data from Horizon API.
 
@@ -22,15 +141,17 @@ def get_product_list(product_list_path: str, subsite: str = 'www.myprotein.com',
         currency: Currency code (e.g., 'GBP', 'USD', 'EUR')
         shippingDestination: Country code for shipping (e.g., 'GB', 'US')
         sort: Sort order (e.g., 'RELEVANCE', 'PRICE_LOW_TO_HIGH', 'PRICE_HIGH_TO_LOW')
+        rate_limiter: Optional horizon_client.HorizonRateLimiter to pace and retry requests
+        raw: Return the response as undecoded bytes
 
     Returns:
         JSON response from Horizon API
     """
-    query = get_product_list_query(product_list_path, limit, offset, currency, shippingDestination, sort)
-    return query_horizon(query, subsite)
+    query, variables = get_product_list_query(product_list_path, limit, offset, currency, shippingDestination, sort)
+    return _query_persisted(query, subsite, variables, rate_limiter, raw)
 
 
-def get_search_results(search_term: str, subsite: str = 'www.myprotein.com', limit: int = 100, offset: int = 0, currency: str = 'GBP', shippingDestination: str = 'GB', sort: str = 'RELEVANCE'):
+def get_search_results(search_term: str, subsite: str = 'www.myprotein.com', limit: int = 100, offset: int = 0, currency: str = 'GBP', shippingDestination: str = 'GB', sort: str = 'RELEVANCE', rate_limiter=None, raw=False):
     """
     Search for products using Horizon search API.
 
@@ -42,12 +163,73 @@ def get_search_results(search_term: str, subsite: str = 'www.myprotein.com', lim
         currency: Currency code (e.g., 'GBP', 'USD', 'EUR')
         shippingDestination: Country code for shipping (e.g., 'GB', 'US')
         sort: Sort order (e.g., 'RELEVANCE', 'PRICE_LOW_TO_HIGH', 'PRICE_HIGH_TO_LOW')
+        rate_limiter: Optional horizon_client.HorizonRateLimiter to pace and retry requests
+        raw: Return the response as undecoded bytes
 
     Returns:
         JSON response from Horizon API
     """
-    query = get_search_query(search_term, limit, offset, currency, shippingDestination, sort)
-    return query_horizon(query, subsite)
+    query, variables = get_search_query(search_term, limit, offset, currency, shippingDestination, sort)
+    return _query_persisted(query, subsite, variables, rate_limiter, raw)
+
+
+def get_product_list_multi(paths, subsite: str = 'www.myprotein.com', limit: int = 100, offset: int = 0, currency: str = 'GBP', shippingDestination: str = 'GB', sort: str = 'RELEVANCE', rate_limiter=None):
+    """
+    Fetch several product list pages with a single GraphQL request.
+
+    Each page is requested under its own alias in one query document (see
+    get_product_list_multi_query), so N pages cost one round-trip.
+
+    Args:
+        paths: Product list paths (without /c prefix), each either a path
+            string or a (path, limit, offset) tuple
+        subsite: The subsite domain
+        limit: Results per page for plain path entries
+        offset: Results to skip for plain path entries
+        currency: Currency code (e.g., 'GBP', 'USD', 'EUR')
+        shippingDestination: Country code for shipping (e.g., 'GB', 'US')
+        sort: Sort order (e.g., 'RELEVANCE', 'PRICE_LOW_TO_HIGH', 'PRICE_HIGH_TO_LOW')
+        rate_limiter: Optional horizon_client.HorizonRateLimiter to pace and retry requests
+
+    Returns:
+        List of JSON responses shaped like get_product_list's, one per path
+
+    Raises:
+        ValueError: If the response does not contain a page for every path
+    """
+    pages = [(path, limit, offset) if isinstance(path, str) else path for path in paths]
+    query, variables = get_product_list_multi_query(pages, currency, shippingDestination, sort)
+    data = _loads(query_horizon_raw(query, subsite, variables, rate_limiter, True)).get('data') or {}
+    results = []
+    for i in range(len(pages)):
+        page = data.get(f'p{i}')
+        if page is None:
+            raise ValueError("Horizon API did not return every aliased product list page")
+        results.append(json.dumps({'data': {'page': page}}))
+    return results
+
+
+PRODUCT_LIST_QUERY = """query ProductList($path: String!, $currency: Currency!, $shippingDestination: Country!, $limit: Int!, $offset: Int!, $sort: ProductSort!) {
+  page(path: $path) {
+    widgets {
+      ... on ProductListWidget {
+        productList(input: {
+          currency: $currency
+          shippingDestination: $shippingDestination
+          limit: $limit
+          offset: $offset
+          sort: $sort
+          facets: []
+        }) {
+          total
+          products {
+            url
+          }
+        }
+      }
+    }
+  }
+}"""
 
 
 def get_product_list_query(product_list_path: str, limit: int = 100, offset: int = 0, currency: str = 'GBP', shippingDestination: str = 'GB', sort: str = 'RELEVANCE'):
@@ -55,6 +237,9 @@ def get_product_list_query(product_list_path: str, limit: int = 100, offset: int
     Build GraphQL query to fetch product URLs from a product list page.
     Simplified query that only requests the url field.
 
+    The query text is the constant PRODUCT_LIST_QUERY; the arguments are
+    passed as GraphQL variables.
+
     Args:
         product_list_path: The path to the product list (without /c prefix)
         limit: Maximum number of results to return
@@ -62,179 +247,338 @@ def get_product_list_query(product_list_path: str, limit: int = 100, offset: int
         currency: Currency code (e.g., 'GBP', 'USD', 'EUR')
         shippingDestination: Country code for shipping (e.g., 'GB', 'US')
         sort: Sort order (e.g., 'RELEVANCE', 'PRICE_LOW_TO_HIGH', 'PRICE_HIGH_TO_LOW')
+
+    Returns:
+        Tuple of (query, variables)
     """
-    return f"""query ProductList {{
-  page(path: "{product_list_path}") {{
-    widgets {{
-      ... on ProductListWidget {{
-        productList(input: {{
-          currency: {currency}
-          shippingDestination: {shippingDestination}
-          limit: {limit}
-          offset: {offset}
-          sort: {sort}
+    return PRODUCT_LIST_QUERY, {
+        'path': product_list_path,
+        'limit': limit,
+        'offset': offset,
+        'currency': currency,
+        'shippingDestination': shippingDestination,
+        'sort': sort,
+    }
+
+
+_PRODUCT_LIST_ALIAS_TEMPLATE = """  p%(i)d: page(path: $path%(i)d) {
+    widgets {
+      ... on ProductListWidget {
+        productList(input: {
+          currency: $currency
+          shippingDestination: $shippingDestination
+          limit: $limit%(i)d
+          offset: $offset%(i)d
+          sort: $sort
           facets: []
-        }}) {{
+        }) {
           total
-          products {{
+          products {
             url
-          }}
-        }}
-      }}
-    }}
-  }}
-}}"""
-
-def get_product_query(product_sku: int):
-    return f"""query Product {{                                                                                            
-  product(sku: {product_sku}, strict: false) {{                                                                            
-    sku,                                                                                                                   
-    title                                                                                                                  
-    content {{                                                                                                             
-      key                                                                                                                  
-      value {{                                                                                                             
-        ... on ProductContentStringValue {{                                                                                
-          stringValue: value                                                                                               
-        }}                                                                                                                 
-        ... on ProductContentStringListValue {{                                                                            
-          stringListValue: value                                                                                           
-        }}                                                                                                                 
-        ... on ProductContentIntValue {{                                                                                   
-          intValue: value                                                                                                  
-        }}                                                                                                                 
-        ... on ProductContentIntListValue {{                                                                               
-          intListValue: value                                                                                              
-        }}                                                                                                                 
-        ... on ProductContentRichContentValue {{                                                                           
-          richContentValue: value {{                                                                                       
-            content {{                                                                                                     
-              type                                                                                                         
-              content                                                                                                      
-            }}                                                                                                             
-          }}                                                                                                               
-        }}                                                                                                                 
-        ... on ProductContentRichContentListValue {{                                                                       
-          richContentListValue: value {{                                                                                   
-            content {{                                                                                                     
-              type                                                                                                         
-              content                                                                                                      
-            }}                                                                                                             
-          }}                                                                                                               
-        }}                                                                                                                 
-      }}                                                                                                                   
-    }}                                                                                                                     
-    variants{{                                                                                                             
-      sku                                                                                                                  
-      title                                                                                                                
-      inStock                                                                                                              
-      images(limit: 4){{                                                                                                   
-        original                                                                                                           
-        thumbnail                                                                                                          
-      }}                                                                                                                   
-                                                                                                                           
-    }}                                                                                                                     
-                                                                                                                           
-}}                                                                                                                         
-}}"""
+          }
+        }
+      }
+    }
+  }
+"""
 
 
-def get_search_query(search_term: str, limit: int = 100, offset: int = 0, currency: str = 'GBP', shippingDestination: str = 'GB', sort: str = 'RELEVANCE'):
+def get_product_list_multi_query(pages, currency: str = 'GBP', shippingDestination: str = 'GB', sort: str = 'RELEVANCE'):
     """
-    Build GraphQL query to search for products.
-    Returns only product URLs.
+    Build one GraphQL query that fetches several product list pages.
+
+    Page i is selected under the alias p<i>, with its own $path<i>,
+    $limit<i> and $offset<i> variables; currency, shipping destination and
+    sort are shared.
 
     Args:
-        search_term: The search query string
-        limit: Maximum number of results to return
-        offset: Number of results to skip (for pagination)
+        pages: Sequence of (product_list_path, limit, offset) tuples
         currency: Currency code (e.g., 'GBP', 'USD', 'EUR')
         shippingDestination: Country code for shipping (e.g., 'GB', 'US')
         sort: Sort order (e.g., 'RELEVANCE', 'PRICE_LOW_TO_HIGH', 'PRICE_HIGH_TO_LOW')
+
+    Returns:
+        Tuple of (query, variables)
+    """
+    variables = {
+        'currency': currency,
+        'shippingDestination': shippingDestination,
+        'sort': sort,
+    }
+    for i, (path, limit, offset) in enumerate(pages):
+        variables[f'path{i}'] = path
+        variables[f'limit{i}'] = limit
+        variables[f'offset{i}'] = offset
+    return _product_list_multi_query(len(pages)), variables
+
+
+@lru_cache(maxsize=64)
+def _product_list_multi_query(count):
+    params = ''.join(f', $path{i}: String!, $limit{i}: Int!, $offset{i}: Int!' for i in range(count))
+    aliases = ''.join(_PRODUCT_LIST_ALIAS_TEMPLATE % {'i': i} for i in range(count))
+    return f"query ProductListMulti($currency: Currency!, $shippingDestination: Country!, $sort: ProductSort!{params}) {{\n{aliases}}}"
+
+
+_PRODUCT_QUERY_TEMPLATE = """query Product($sku: SKU!) {
+  product(sku: $sku, strict: false) {
+%s  }
+}"""
+
+_CONTENT_FRAG = """    content {
+      key
+      value {
+        ... on ProductContentStringValue {
+          stringValue: value
+        }
+        ... on ProductContentStringListValue {
+          stringListValue: value
+        }
+        ... on ProductContentIntValue {
+          intValue: value
+        }
+        ... on ProductContentIntListValue {
+          intListValue: value
+        }
+        ... on ProductContentRichContentValue {
+          richContentValue: value {
+            content {
+              type
+              content
+            }
+          }
+        }
+        ... on ProductContentRichContentListValue {
+          richContentListValue: value {
+            content {
+              type
+              content
+            }
+          }
+        }
+      }
+    }
+"""
+
+_VARIANTS_FRAG = """    variants {
+      sku
+      title
+      inStock
+      images(limit: 4) {
+        original
+        thumbnail
+      }
+    }
+"""
+
+_PRODUCT_FIELD_FRAGS = {
+    'sku': '    sku\n',
+    'title': '    title\n',
+    'url': '    url\n',
+    'content': _CONTENT_FRAG,
+    'variants': _VARIANTS_FRAG,
+}
+
+
+def get_product_query(product_sku: int, fields=PRODUCT_FULL_FIELDS):
     """
-    return f"""query Search {{
+    Build GraphQL query to fetch a product by SKU.
+
+    The query text depends only on fields; the SKU is passed as the $sku
+    variable, so the same text can be sent as a persisted query for every
+    product (see horizon_client.query_horizon_persisted).
+
+    Args:
+        product_sku: The product SKU
+        fields: Product fields to request, any of 'sku', 'title', 'url',
+            'content' and 'variants' (default: PRODUCT_FULL_FIELDS)
+
+    Returns:
+        Tuple of (query, variables)
+    """
+    return _product_query(tuple(fields)), {'sku': product_sku}
+
+
+@lru_cache(maxsize=64)
+def _product_query(fields):
+    try:
+        selection = ''.join(_PRODUCT_FIELD_FRAGS[field] for field in fields)
+    except KeyError as e:
+        raise ValueError(f"Unknown product field: {e.args[0]}") from None
+    return _PRODUCT_QUERY_TEMPLATE % selection
+
+
+def get_product_full_query(product_sku: int):
+    """Build GraphQL query for a product with content fields and variants."""
+    return get_product_query(product_sku, PRODUCT_FULL_FIELDS)
+
+
+def get_product_summary_query(product_sku: int):
+    """Build GraphQL query for just a product's SKU and title."""
+    return get_product_query(product_sku, PRODUCT_SUMMARY_FIELDS)
+
+
+SEARCH_QUERY = """query Search($term: String!, $currency: Currency!, $shippingDestination: Country!, $limit: Int!, $offset: Int!, $sort: ProductSort!) {
   search(
-    options: {{
-      currency: {currency}
-      shippingDestination: {shippingDestination}
-      limit: {limit}
-      offset: {offset}
-      sort: {sort}
+    options: {
+      currency: $currency
+      shippingDestination: $shippingDestination
+      limit: $limit
+      offset: $offset
+      sort: $sort
       facets: []
-    }}
-    query: "{search_term}"
-  ) {{
+    }
+    query: $term
+  ) {
     total
-    products {{
+    products {
       url
-    }}
-  }}
-}}"""
+    }
+  }
+}"""
+
 
+def get_search_query(search_term: str, limit: int = 100, offset: int = 0, currency: str = 'GBP', shippingDestination: str = 'GB', sort: str = 'RELEVANCE'):
+    """
+    Build GraphQL query to search for products.
+    Returns only product URLs.
 
+    The query text is the constant SEARCH_QUERY; the arguments are passed as
+    GraphQL variables, so search terms need no escaping.
 
+    Args:
+        search_term: The search query string
+        limit: Maximum number of results to return
+        offset: Number of results to skip (for pagination)
+        currency: Currency code (e.g., 'GBP', 'USD', 'EUR')
+        shippingDestination: Country code for shipping (e.g., 'GB', 'US')
+        sort: Sort order (e.g., 'RELEVANCE', 'PRICE_LOW_TO_HIGH', 'PRICE_HIGH_TO_LOW')
 
-def extract_product_ids_from_list(response_json: str):
+    Returns:
+        Tuple of (query, variables)
+    """
+    return SEARCH_QUERY, {
+        'term': search_term,
+        'limit': limit,
+        'offset': offset,
+        'currency': currency,
+        'shippingDestination': shippingDestination,
+        'sort': sort,
+    }
+
+
+
+
+def _iter_product_list_urls(stream):
+    """Yield product URLs from the first productList widget in a response stream, using ijson."""
+    in_product_list = False
+    for prefix, event, value in _load_ijson().parse(stream):
+        if prefix == 'data.page.widgets.item.productList.products.item.url':
+            yield value
+        elif prefix == 'data.page.widgets.item':
+            if event == 'map_key' and value == 'productList':
+                in_product_list = True
+            elif event == 'end_map' and in_product_list:
+                return
+
+
+def _iter_product_ids(urls: Iterable[str]) -> Iterator[int]:
+    """Yield the product ID from each product URL that has one."""
+    # Extract product ID from URL pattern: /p/category/product-name/12345678/
+    # The ID is the last path segment, so split it off directly and only fall
+    # back to the regex for URLs of an unexpected shape. Strings without any
+    # slash (e.g. category placeholders in error responses) have no ID.
+    search = _ID_RE.search
+    for url in urls:
+        if '/' not in url:
+            continue
+        tail = url.rstrip('/').rpartition('/')[2]
+        if tail.isascii() and tail.isdecimal():
+            yield int(tail)
+        elif match := search(url):
+            yield int(match.group(1))
+
+
+def _product_ids_from_urls(urls: list[str], dedup: bool = False) -> list[int]:
+    product_ids = _iter_product_ids(urls)
+    if dedup:
+        # dict keeps first-seen order
+        return list(dict.fromkeys(product_ids))
+    return list(product_ids)
+
+
+def extract_product_ids_from_list(response_json: bytes | str, dedup: bool = False) -> list[int]:
     """
     Extract product IDs from a product list API response.
 
+    The response is parsed in full with orjson or json. Without orjson, an
+    ijson C backend (when installed) is used instead to pull out just the
+    product URLs, falling back to the full parse if it finds none, e.g.
+    because the response has an unexpected shape.
+
     Args:
-        response_json: JSON string response from Horizon API
+        response_json: JSON response from Horizon API (bytes or str)
+        dedup: Drop repeated product IDs, keeping the first occurrence
 
     Returns:
         List of product IDs (integers)
     """
+    if _IJSON_EXTRACT:
+        if isinstance(response_json, str):
+            response_json = response_json.encode('utf-8')
+        try:
+            urls = list(_iter_product_list_urls(io.BytesIO(response_json)))
+        except ijson.JSONError as e:
+            print(f"Error parsing product list response: {e}", file=sys.stderr)
+            return []
+        if urls:
+            return _product_ids_from_urls(urls, dedup)
+
     try:
-        data = json.loads(response_json)
+        data = _loads(response_json)
         widgets = data['data']['page']['widgets']
 
         # Find the widget with productList (may not be at index 0)
-        products = None
-        for widget in widgets:
-            if 'productList' in widget:
-                products = widget['productList']['products']
-                break
+        products = next((widget['productList']['products'] for widget in widgets if 'productList' in widget), None)
 
         if products is None:
             print("Error: No productList widget found", file=sys.stderr)
             return []
 
-        product_ids = []
-        for product in products:
-            url = product['url']
-            # Extract product ID from URL pattern: /p/category/product-name/12345678/
-            match = re.search(r'/(\d+)/', url)
-            if match:
-                product_ids.append(int(match.group(1)))
-
-        return product_ids
+        return _product_ids_from_urls([product['url'] for product in products], dedup)
     except (KeyError, IndexError, json.JSONDecodeError) as e:
         print(f"Error parsing product list response: {e}", file=sys.stderr)
         return []
 
 
-def extract_product_ids_from_search(response_json: str):
+def extract_product_ids_from_search(response_json: bytes | str, dedup: bool = False) -> list[int]:
     """
     Extract product IDs from a search API response.
 
+    Parses the response the same way as extract_product_ids_from_list.
+
     Args:
-        response_json: JSON string response from Horizon API
+        response_json: JSON response from Horizon API (bytes or str)
+        dedup: Drop repeated product IDs, keeping the first occurrence
 
     Returns:
         List of product IDs (integers)
     """
+    if _IJSON_EXTRACT:
+        if isinstance(response_json, str):
+            response_json = response_json.encode('utf-8')
+        try:
+            urls = list(ijson.items(io.BytesIO(response_json), 'data.search.products.item.url'))
+        except ijson.JSONError as e:
+            print(f"Error parsing search response: {e}", file=sys.stderr)
+            return []
+        if urls:
+            return _product_ids_from_urls(urls, dedup)
+
     try:
-        data = json.loads(response_json)
+        data = _loads(response_json)
         products = data['data']['search']['products']
 
-        product_ids = []
-        for product in products:
-            url = product['url']
-            # Extract product ID from URL pattern: /p/category/product-name/12345678/
-            match = re.search(r'/(\d+)/', url)
-            if match:
-                product_ids.append(int(match.group(1)))
-
-        return product_ids
+        return _product_ids_from_urls([product['url'] for product in products], dedup)
     except (KeyError, IndexError, json.JSONDecodeError) as e:
         print(f"Error parsing search response: {e}", file=sys.stderr)
         return []
@@ -242,9 +586,29 @@ def extract_product_ids_from_search(response_json: str):
 
 def is_url(input_str: str) -> bool:
     """Check if the input string is a URL."""
-    return input_str.startswith('http://') or input_str.startswith('https://')
+    return input_str.startswith(('http://', 'https://'))
+
 
-def get_product_ids(url, limit=100, offset=0, currency='GBP', shippingDestination='GB', sort='RELEVANCE', subsite='www.myprotein.com'):
+def _split_product_list_url(url: str):
+    """
+    Split a product list URL into its subsite and product list path.
+
+    The path has any '/c' prefix and trailing slash removed, matching what
+    get_product_list expects.
+    """
+    rest = url.partition('://')[2]
+    rest = rest.partition('?')[0].partition('#')[0]
+    subsite, sep, path = rest.partition('/')
+    path = sep + path
+
+    # Remove '/c' prefix if present
+    if path.startswith('/c/'):
+        path = path[2:]
+
+    # Remove trailing slash if present
+    return subsite, path.removesuffix('/')
+
+def get_product_ids(url, limit=100, offset=0, currency='GBP', shippingDestination='GB', sort='RELEVANCE', subsite='www.myprotein.com', dedup=False):
     """
     Fetch product IDs from a URL or search term.
 
@@ -256,6 +620,7 @@ def get_product_ids(url, limit=100, offset=0, currency='GBP', shippingDestinatio
         shippingDestination: Country code for shipping (e.g., 'GB', 'US')
         sort: Sort order (e.g., 'RELEVANCE', 'PRICE_LOW_TO_HIGH', 'PRICE_HIGH_TO_LOW')
         subsite: Subsite domain for search queries (default: 'www.myprotein.com', ignored for URL queries)
+        dedup: Drop repeated product IDs, keeping the first occurrence
 
     Returns:
         List of product IDs (integers)
@@ -264,31 +629,23 @@ def get_product_ids(url, limit=100, offset=0, currency='GBP', shippingDestinatio
     # Determine if input is a URL or search term
     if is_url(input_arg):
         # URL mode - fetch product list
-        parsed = urlparse(input_arg)
-        url_subsite = parsed.netloc
-        product_list_path = parsed.path
-
-        # Remove '/c' prefix if present
-        if product_list_path.startswith('/c/'):
-            product_list_path = product_list_path[2:]
-
-        # Remove trailing slash if present
-        if product_list_path.endswith('/'):
-            product_list_path = product_list_path[:-1]
+        url_subsite, product_list_path = _split_product_list_url(input_arg)
 
         if not url_subsite or not product_list_path:
             print("Error: Invalid URL. Must include both domain and path.", file=sys.stderr)
             sys.exit(1)
 
-        response = get_product_list(product_list_path, url_subsite, limit, offset, currency, shippingDestination, sort)
-        product_ids = extract_product_ids_from_list(response)
+        response = get_product_list(product_list_path, url_subsite, limit, offset, currency, shippingDestination, sort, raw=True)
+        product_ids = extract_product_ids_from_list(response, dedup)
+        del response
 
     else:
         # Search mode - use the subsite parameter
         search_term = input_arg
 
-        response = get_search_results(search_term, subsite, limit, offset, currency, shippingDestination, sort)
-        product_ids = extract_product_ids_from_search(response)
+        response = get_search_results(search_term, subsite, limit, offset, currency, shippingDestination, sort, raw=True)
+        product_ids = extract_product_ids_from_search(response, dedup)
+        del response
 
     if not product_ids:
         print("No product IDs found", file=sys.stderr)
@@ -297,8 +654,276 @@ def get_product_ids(url, limit=100, offset=0, currency='GBP', shippingDestinatio
     return product_ids
 
 
-def main():
-    """Command-line interface for Horizon API utilities."""
+# With parallel_extract=True, aget_product_ids only parses responses in
+# worker processes once they add up to this many bytes: URL-only pages parse
+# in microseconds, so below that starting the processes costs more than the
+# parsing it spreads out.
+_PARALLEL_EXTRACT_MIN_BYTES = 8 * 1024 * 1024
+
+
+def _extract_all(extract, responses):
+    """
+    Run extract over every response and concatenate the product IDs.
+
+    Each entry of responses is cleared once it has been parsed.
+    """
+    return [product_id for response in _release_each(responses) for product_id in extract(response)]
+
+
+async def _extract_in_processes(extract, responses):
+    """
+    Run extract over every response in worker processes.
+
+    Called from the event loop thread after the request threads have
+    finished, so the workers are not forked while other threads are
+    running. If processes cannot be started here, falls back to
+    _extract_all in a worker thread.
+    """
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+
+    loop = asyncio.get_running_loop()
+    try:
+        with ProcessPoolExecutor(max_workers=min(len(responses), os.cpu_count() or 1)) as pool:
+            pages = await asyncio.gather(*[loop.run_in_executor(pool, extract, response) for response in responses])
+    except (OSError, NotImplementedError, BrokenProcessPool):
+        return await asyncio.to_thread(_extract_all, extract, responses)
+    return [product_id for page in pages for product_id in page]
+
+
+def _release_each(items):
+    """Yield the items of a list, clearing each slot so it can be freed once used."""
+    for i in range(len(items)):
+        item, items[i] = items[i], None
+        yield item
+
+
+async def aget_product_ids(url, limit=100, offset=0, currency='GBP', shippingDestination='GB', sort='RELEVANCE', subsite='www.myprotein.com', max_results=None, max_concurrency=64, rate_limiter=None, pages_per_request=10, dedup=False, parallel_extract=False):
+    """
+    Fetch product IDs from a URL or search term, fetching pages concurrently.
+
+    Async variant of get_product_ids. With max_results set, results are
+    requested as consecutive pages of up to limit products starting at
+    offset, and all pages are fetched at once (at most max_concurrency in
+    flight), so collecting N pages costs about one round-trip instead of N.
+    For product list URLs, up to pages_per_request pages are also combined
+    into a single aliased query (see get_product_list_multi); if that is
+    rejected, those pages are requested one by one.
+
+    Args:
+        url: Either a product list URL or a search term
+        limit: Maximum number of results per page
+        offset: Number of results to skip (for pagination)
+        currency: Currency code (e.g., 'GBP', 'USD', 'EUR')
+        shippingDestination: Country code for shipping (e.g., 'GB', 'US')
+        sort: Sort order (e.g., 'RELEVANCE', 'PRICE_LOW_TO_HIGH', 'PRICE_HIGH_TO_LOW')
+        subsite: Subsite domain for search queries (default: 'www.myprotein.com', ignored for URL queries)
+        max_results: Total number of results to fetch across pages (default: a single page of limit)
+        max_concurrency: Maximum number of page requests in flight at once
+        rate_limiter: Optional horizon_client.HorizonRateLimiter to pace and retry requests
+        pages_per_request: Maximum number of product list pages per aliased query (1 disables aliasing)
+        dedup: Drop product IDs repeated within or across pages, keeping the first occurrence
+        parallel_extract: Parse the responses in worker processes when there are
+            several CPUs and the responses total at least 8 MB. As with any use
+            of multiprocessing, the calling script's entry point must be
+            guarded by if __name__ == '__main__'.
+
+    Returns:
+        List of product IDs (integers), in page order
+    """
+    if is_url(url):
+        subsite, product_list_path = _split_product_list_url(url)
+        if not subsite or not product_list_path:
+            print("Error: Invalid URL. Must include both domain and path.", file=sys.stderr)
+            sys.exit(1)
+
+        def build_query(page_limit, page_offset):
+            return get_product_list_query(product_list_path, page_limit, page_offset, currency, shippingDestination, sort)
+        extract = extract_product_ids_from_list
+    else:
+        def build_query(page_limit, page_offset):
+            return get_search_query(url, page_limit, page_offset, currency, shippingDestination, sort)
+        extract = extract_product_ids_from_search
+        pages_per_request = 1
+
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    total = limit if max_results is None else max_results
+
+    async def fetch_page(start):
+        query, variables = build_query(min(limit, total - start), offset + start)
+        return await loop.run_in_executor(executor, query_horizon_raw, query, subsite, variables, rate_limiter, True)
+
+    async def fetch_group(starts):
+        if len(starts) > 1:
+            pages = [(product_list_path, min(limit, total - start), offset + start) for start in starts]
+            try:
+                return await loop.run_in_executor(executor, partial(get_product_list_multi, pages, subsite, currency=currency, shippingDestination=shippingDestination, sort=sort, rate_limiter=rate_limiter))
+            except ValueError:
+                pass
+        return await asyncio.gather(*[fetch_page(start) for start in starts])
+
+    starts = range(0, total, limit)
+    # The requests block, so they run on a pool of their own: the loop's
+    # default executor only has min(32, CPUs + 4) threads, which would cap
+    # concurrency well below max_concurrency on small machines.
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        groups = await asyncio.gather(*[fetch_group(starts[i:i + pages_per_request]) for i in range(0, len(starts), pages_per_request)])
+    responses = [response for group in groups for response in group]
+    # Leave responses as the only reference to the raw pages, so
+    # _extract_all can free each one as soon as it is parsed
+    del groups
+    if parallel_extract and (os.cpu_count() or 1) > 1 and sum(map(len, responses)) >= _PARALLEL_EXTRACT_MIN_BYTES:
+        product_ids = await _extract_in_processes(extract, responses)
+    else:
+        product_ids = await asyncio.to_thread(_extract_all, extract, responses)
+    del responses
+    if dedup:
+        product_ids = list(dict.fromkeys(product_ids))
+
+    if not product_ids:
+        print("No product IDs found", file=sys.stderr)
+        sys.exit(1)
+
+    return product_ids
+
+
+def get_product_ids_stream(url, limit=100, offset=0, currency='GBP', shippingDestination='GB', sort='RELEVANCE', subsite='www.myprotein.com', dedup=False):
+    """
+    Yield product IDs from a URL or search term as the response arrives.
+
+    Like get_product_ids, but a generator: with ijson installed, IDs are parsed
+    straight off the socket, so callers can start work on the first products
+    (e.g. feed them to get_product_jsons) before the listing has finished
+    downloading. Without ijson the response is read in full first. Errors are
+    printed to stderr and end the stream; responses are not written to the
+    disk cache.
+
+    Args:
+        url: Either a product list URL or a search term
+        limit: Maximum number of results to return
+        offset: Number of results to skip (for pagination)
+        currency: Currency code (e.g., 'GBP', 'USD', 'EUR')
+        shippingDestination: Country code for shipping (e.g., 'GB', 'US')
+        sort: Sort order (e.g., 'RELEVANCE', 'PRICE_LOW_TO_HIGH', 'PRICE_HIGH_TO_LOW')
+        subsite: Subsite domain for search queries (default: 'www.myprotein.com', ignored for URL queries)
+        dedup: Skip repeated product IDs, keeping the first occurrence
+
+    Yields:
+        Product IDs (integers)
+    """
+    if is_url(url):
+        subsite, product_list_path = _split_product_list_url(url)
+        if not subsite or not product_list_path:
+            print("Error: Invalid URL. Must include both domain and path.", file=sys.stderr)
+            return
+        query, variables = get_product_list_query(product_list_path, limit, offset, currency, shippingDestination, sort)
+        kind = 'product list'
+    else:
+        query, variables = get_search_query(url, limit, offset, currency, shippingDestination, sort)
+        kind = 'search'
+
+    ijson = _load_ijson()
+    with query_horizon_stream(query, subsite, variables) as stream:
+        if ijson is None:
+            extract = extract_product_ids_from_list if kind == 'product list' else extract_product_ids_from_search
+            yield from extract(stream.read(), dedup)
+            return
+
+        if kind == 'product list':
+            urls = _iter_product_list_urls(stream)
+        else:
+            urls = ijson.items(stream, 'data.search.products.item.url')
+        seen = set()
+        try:
+            for product_id in _iter_product_ids(urls):
+                if dedup:
+                    if product_id in seen:
+                        continue
+                    seen.add(product_id)
+                yield product_id
+        except ijson.JSONError as e:
+            print(f"Error parsing {kind} response: {e}", file=sys.stderr)
+
+
+def _emit(content):
+    """Write CLI output (bytes or str) to stdout as UTF-8, followed by a newline."""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    out = sys.stdout.buffer
+    out.write(content)
+    out.write(b'\n')
+
+
+# Options of the `ids` command understood by _parse_fast_ids, with the same
+# defaults as the argparse parser
+_FAST_IDS_OPTIONS = {
+    '--subsite': ('subsite', str),
+    '--limit': ('limit', int),
+    '--offset': ('offset', int),
+    '--currency': ('currency', str),
+    '--shipping': ('shippingDestination', str),
+    '--sort': ('sort', str),
+}
+_FAST_IDS_FLAGS = {
+    '--no-cache': 'no_cache',
+    '--dedup': 'dedup',
+}
+
+
+def _parse_fast_ids(argv):
+    """
+    Parse a plain `ids` command line without building the argparse parser.
+
+    `ids` is the command most often run from shell loops. Returns an
+    argparse-style namespace, or None for any other command or anything
+    unusual (help, unknown options, bad values), which is then left to
+    argparse so it can report errors as usual.
+    """
+    if len(argv) < 2 or argv[0] != 'ids':
+        return None
+
+    values = {
+        'query': None,
+        'subsite': 'www.myprotein.com',
+        'limit': 100,
+        'offset': 0,
+        'currency': 'GBP',
+        'shippingDestination': 'GB',
+        'sort': 'RELEVANCE',
+        'no_cache': False,
+        'dedup': False,
+    }
+    args = iter(argv[1:])
+    for arg in args:
+        if arg in _FAST_IDS_FLAGS:
+            values[_FAST_IDS_FLAGS[arg]] = True
+        elif arg in _FAST_IDS_OPTIONS:
+            name, cast = _FAST_IDS_OPTIONS[arg]
+            value = next(args, None)
+            if value is None or value.startswith('--'):
+                return None
+            try:
+                values[name] = cast(value)
+            except ValueError:
+                return None
+        elif arg.startswith('-') or values['query'] is not None:
+            return None
+        else:
+            values['query'] = arg
+
+    if values['query'] is None:
+        return None
+    return SimpleNamespace(command='ids', **values)
+
+
+def _build_parser():
+    """Build the argparse parser for the full command-line interface."""
+    # Imported here so the _parse_fast_ids path never loads argparse
+    import argparse
+
     parser = argparse.ArgumentParser(
         description='Horizon API command-line utility for fetching product data',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -331,10 +956,12 @@ Examples:
         subparser.add_argument('--currency', default='GBP', help='Currency code (default: GBP)')
         subparser.add_argument('--shipping', dest='shippingDestination', default='GB', help='Shipping destination country code (default: GB)')
         subparser.add_argument('--sort', default='RELEVANCE', help='Sort order (default: RELEVANCE)')
+        subparser.add_argument('--no-cache', action='store_true', help='Bypass the response cache')
 
     # get_product_ids command
     parser_ids = subparsers.add_parser('ids', help='Get product IDs from URL or search term')
     parser_ids.add_argument('query', help='Product list URL or search term')
+    parser_ids.add_argument('--dedup', action='store_true', help='Drop repeated product IDs')
     add_common_args(parser_ids)
 
     # get_product_json command
@@ -342,6 +969,7 @@ Examples:
     parser_product.add_argument('sku', type=int, help='Product SKU')
     parser_product.add_argument('--subsite', default='www.myprotein.com', help='Subsite domain (default: www.myprotein.com)')
     parser_product.add_argument('--pretty', action='store_true', help='Pretty-print JSON output')
+    parser_product.add_argument('--no-cache', action='store_true', help='Bypass the response cache')
 
     # get_search_results command
     parser_search = subparsers.add_parser('search', help='Search for products')
@@ -355,11 +983,22 @@ Examples:
     parser_list.add_argument('--pretty', action='store_true', help='Pretty-print JSON output')
     add_common_args(parser_list)
 
-    args = parser.parse_args()
+    return parser
 
-    if not args.command:
-        parser.print_help()
-        sys.exit(1)
+
+def main():
+    """Command-line interface for Horizon API utilities."""
+    args = _parse_fast_ids(sys.argv[1:])
+    if args is None:
+        parser = _build_parser()
+        args = parser.parse_args()
+
+        if not args.command:
+            parser.print_help()
+            sys.exit(1)
+
+    if args.no_cache:
+        os.environ['HORIZON_NO_CACHE'] = '1'
 
     try:
         if args.command == 'ids':
@@ -371,17 +1010,15 @@ Examples:
                 currency=args.currency,
                 shippingDestination=args.shippingDestination,
                 sort=args.sort,
-                subsite=args.subsite
+                subsite=args.subsite,
+                dedup=args.dedup
             )
-            print(json.dumps(product_ids, indent=2))
+            _emit(_dumps_pretty(product_ids))
 
         elif args.command == 'product':
             # Get product details
-            result = get_product_json(args.sku, args.subsite)
-            if args.pretty:
-                print(json.dumps(json.loads(result), indent=2))
-            else:
-                print(result)
+            result = get_product_json(args.sku, args.subsite, raw=True)
+            _emit(_dumps_pretty(_loads(result)) if args.pretty else result)
 
         elif args.command == 'search':
             # Search for products
@@ -392,12 +1029,10 @@ Examples:
                 offset=args.offset,
                 currency=args.currency,
                 shippingDestination=args.shippingDestination,
-                sort=args.sort
+                sort=args.sort,
+                raw=True
             )
-            if args.pretty:
-                print(json.dumps(json.loads(result), indent=2))
-            else:
-                print(result)
+            _emit(_dumps_pretty(_loads(result)) if args.pretty else result)
 
         elif args.command == 'list':
             # Get product list
@@ -408,12 +1043,10 @@ Examples:
                 offset=args.offset,
                 currency=args.currency,
                 shippingDestination=args.shippingDestination,
-                sort=args.sort
+                sort=args.sort,
+                raw=True
             )
-            if args.pretty:
-                print(json.dumps(json.loads(result), indent=2))
-            else:
-                print(result)
+            _emit(_dumps_pretty(_loads(result)) if args.pretty else result)
 
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
@@ -0,0 +1,97 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import horizon_client
+from horizon_client import HorizonRateLimiter
+
+
+class FakeClock:
+    """Stands in for time.monotonic/time.sleep so the bucket can be tested without waiting."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def response(status_code=200, **headers):
+    return SimpleNamespace(status_code=status_code, headers=headers)
+
+
+class HorizonRateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(horizon_client, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_up_to_rps_then_paced(self):
+        limiter = HorizonRateLimiter(default_rps=10)
+        for _ in range(10):
+            limiter.acquire('s')
+        self.assertEqual(self.clock.now, 1000.0)
+        limiter.acquire('s')
+        self.assertAlmostEqual(self.clock.now, 1000.1)
+
+    def test_subsites_have_separate_buckets(self):
+        limiter = HorizonRateLimiter(default_rps=1)
+        limiter.acquire('a')
+        limiter.acquire('b')
+        self.assertEqual(self.clock.now, 1000.0)
+
+    def test_rate_below_one_still_acquires(self):
+        limiter = HorizonRateLimiter(default_rps=0.5)
+        limiter.acquire('s')
+        self.assertEqual(self.clock.now, 1000.0)
+        limiter.acquire('s')
+        self.assertAlmostEqual(self.clock.now, 1002.0)
+
+    def test_non_positive_rate_rejected(self):
+        with self.assertRaises(ValueError):
+            HorizonRateLimiter(default_rps=0)
+
+    def test_remaining_zero_drains_bucket_after_round_trip(self):
+        limiter = HorizonRateLimiter(default_rps=10)
+        limiter.acquire('s')
+        self.clock.now += 0.3  # request round-trip
+        self.assertFalse(limiter.update('s', response(**{'X-RateLimit-Remaining': '0'})))
+        limiter.acquire('s')
+        self.assertAlmostEqual(self.clock.now, 1000.4)
+        limiter.acquire('s')
+        self.assertAlmostEqual(self.clock.now, 1000.5)
+
+    def test_retry_after_blocks_subsite(self):
+        limiter = HorizonRateLimiter(default_rps=10)
+        self.assertTrue(limiter.update('s', response(429, **{'Retry-After': '3'})))
+        limiter.acquire('s')
+        self.assertAlmostEqual(self.clock.now, 1003.0)
+
+    def test_retry_after_zero_uses_backoff(self):
+        limiter = HorizonRateLimiter(default_rps=10, backoff_base=0.5)
+        with mock.patch.object(horizon_client.random, 'uniform', return_value=0):
+            self.assertTrue(limiter.update('s', response(429, **{'Retry-After': '0'}), attempt=2))
+        limiter.acquire('s')
+        self.assertAlmostEqual(self.clock.now, 1002.0)
+
+    def test_backoff_grows_and_is_capped(self):
+        limiter = HorizonRateLimiter(default_rps=10, max_retries=20, backoff_base=0.5, backoff_cap=3.0)
+        with mock.patch.object(horizon_client.random, 'uniform', return_value=0):
+            limiter.update('s', response(503), attempt=1)
+            self.assertAlmostEqual(limiter._blocked_until['s'], 1001.0)
+            limiter.update('t', response(503), attempt=10)
+            self.assertAlmostEqual(limiter._blocked_until['t'], 1003.0)
+
+    def test_retries_stop_after_max_retries(self):
+        limiter = HorizonRateLimiter(max_retries=2)
+        self.assertTrue(limiter.update('s', response(500), attempt=1))
+        self.assertFalse(limiter.update('s', response(500), attempt=2))
+        self.assertFalse(limiter.update('s', response(404)))
+
+
+if __name__ == '__main__':
+    unittest.main()